@@ -3,17 +3,27 @@
 # =============================================================================
 
 import os
+import re
 import json
 import time
 import asyncio
+import hashlib
+import contextlib
+import httpx
+import aiosqlite
 import pandas as pd
 from datetime import datetime
 from typing import Dict, Any, Optional
 from dotenv import load_dotenv
+from aiolimiter import AsyncLimiter
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 
+import openai
+import anthropic
 from openai import AsyncOpenAI
 from anthropic import AsyncAnthropic
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 
 # ----------------------------- CONFIG ----------------------------------------
@@ -25,9 +35,11 @@ DATA_DIR      = cfg["paths"]["data_dir"]
 EXTRACT_DIR   = cfg["paths"]["extract_dir"]
 PROMPT_FILE   = cfg["paths"]["prompt_file"]
 FILTERED_CSV  = os.path.join(DATA_DIR, "filtered_texts.csv")
+CACHE_DB      = os.path.join(DATA_DIR, "llm_cache.sqlite")
 
 SAMPLE_SIZE   = cfg["parameters"]["sample_size"]   # null in config.json = all rows
 BATCH_SIZE    = cfg["parameters"]["batch_size"]
+RPM           = cfg["parameters"]["rpm"]
 BATCH_DELAY   = cfg["parameters"]["batch_delay"]
 MAX_TOKENS    = cfg["parameters"]["max_tokens"]
 
@@ -37,12 +49,91 @@ ANTHROPIC_API_KEY   = os.getenv("ANTHROPIC_API_KEY")
 GOOGLE_API_KEY      = os.getenv("GOOGLE_API_KEY")
 HUGGINGFACE_API_KEY = os.getenv("HUGGINGFACE_API_KEY")
 
-MODELS = {k: {**v, "max_tokens": MAX_TOKENS} for k, v in cfg["models"].items()}
+# genai.configure sets process-wide state, so it runs once here rather than per client.
+if GOOGLE_API_KEY:
+    genai.configure(api_key=GOOGLE_API_KEY)
+
+# batch_size / rpm are fallbacks for models without their own max_concurrency / rpm
+MODELS = {k: {"max_concurrency": BATCH_SIZE, "rpm": RPM, **v, "max_tokens": MAX_TOKENS}
+          for k, v in cfg["models"].items()}
+
+FILE_ID_RE = re.compile(r"^([a-f0-9]{32})")
 
 SYSTEM_PROMPT = "You are a legal data extraction system. Respond ONLY with valid JSON."
 
+BATCH_POLL_MIN = 5     # seconds before the first batch status check
+BATCH_POLL_MAX = 300   # cap on the exponential backoff between checks
+
+RETRY_ATTEMPTS = 6     # per row, for rate limits (429), server errors (5xx) and dropped connections
+RETRY_WAIT_MAX = 60    # cap in seconds on the jittered exponential wait between attempts
+RETRYABLE = (
+    openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError,
+    anthropic.RateLimitError, anthropic.InternalServerError, anthropic.OverloadedError,
+    anthropic.APIConnectionError,
+    google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError, google_exceptions.DeadlineExceeded,
+)
+
+def retrying():
+    # The only retry policy: the SDK clients are built with max_retries=0 so attempts don't multiply.
+    return AsyncRetrying(retry=retry_if_exception_type(RETRYABLE), reraise=True,
+                         wait=wait_random_exponential(multiplier=1, max=RETRY_WAIT_MAX),
+                         stop=stop_after_attempt(RETRY_ATTEMPTS))
+
+GEMINI_SAFETY_SETTINGS = {c: HarmBlockThreshold.BLOCK_NONE for c in [
+    HarmCategory.HARM_CATEGORY_HARASSMENT, HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT, HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT]}
+GEMINI_GENERATION_CONFIG = {"temperature": 0, "top_p": 1, "top_k": 1}
+
+# ----------------------------- RESPONSE CACHE --------------------------------
+
+class LLMCache:
+    """Persistent (model, prompt) -> response store. Every request runs at temperature=0, so
+    a repeated prompt is answered from disk instead of being re-sent to the provider."""
+
+    def __init__(self, path: str):
+        self.path     = path
+        self.db       = None
+        self.prefixes = {}
+
+    async def open(self):
+        self.db = await aiosqlite.connect(self.path)
+        await self.db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, content TEXT, tokens INT)")
+        await self.db.commit()
+
+    async def close(self):
+        await self.db.close()
+
+    def key(self, model_name: str, system: str, user: str) -> str:
+        # sha256(model \0 system \0 user); the hash state after the static prefix is computed once
+        # per model and copied, so the instructions are not re-encoded and re-hashed for every row.
+        if (prefix := self.prefixes.get((model_name, system))) is None:
+            prefix = self.prefixes[(model_name, system)] = hashlib.sha256(f"{model_name}\0{system}\0".encode())
+        h = prefix.copy()
+        h.update(user.encode())
+        return h.hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        # Rows without usable content (e.g. stored before put() validated them) count as misses.
+        async with self.db.execute("SELECT content, tokens FROM cache WHERE key = ? AND TRIM(content) <> ''",
+                                   (key,)) as cur:
+            row = await cur.fetchone()
+        return {"content": row[0], "tokens": row[1], "cached_tokens": 0} if row else None
+
+    async def put(self, key: str, result: Dict[str, Any]):
+        check_content(result)
+        await self.db.execute("INSERT OR REPLACE INTO cache (key, content, tokens) VALUES (?, ?, ?)",
+                              (key, result["content"], result["tokens"]))
+        await self.db.commit()
+
 # ----------------------------- CLIENT BASE -----------------------------------
 
+def pool_limits(concurrency):
+    # Size the connection pool to the worker count so the SDK default (100) never caps or exceeds it.
+    # Only the pool is overridden: the SDKs' DefaultAsyncHttpxClient keeps their 600s timeout, which
+    # non-streaming calls need while a long (max_tokens) generation finishes.
+    return httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
 class LLMClient:
     def __init__(self, model_name: str, llm_type: str):
         self.model_name = model_name
@@ -51,137 +142,386 @@ class LLMClient:
         os.makedirs(self.output_dir, exist_ok=True)
 
     def get_existing_file_ids(self) -> set:
-        return {f.split("_")[0] for f in os.listdir(self.output_dir) if f.endswith(".txt")}
+        with os.scandir(self.output_dir) as entries:
+            return {m.group(1) for e in entries
+                    if e.name.endswith(".txt") and (m := FILE_ID_RE.match(e.name))}
 
-    async def process(self, prompt: str) -> Dict[str, Any]:
+    async def process(self, system: str, user: str) -> Dict[str, Any]:
         raise NotImplementedError
 
 # ----------------------------- CLIENT IMPLEMENTATIONS ------------------------
 
 class OpenAIClient(LLMClient):
-    def __init__(self, model_name, max_tokens):
+    def __init__(self, model_name, max_tokens, concurrency):
         super().__init__(model_name, "openai")
-        self.client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+        self.client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0,
+                                  http_client=openai.DefaultAsyncHttpxClient(limits=pool_limits(concurrency)))
         self.max_tokens = max_tokens
 
-    async def process(self, prompt):
-        r = await self.client.chat.completions.create(
-            model=self.model_name,
-            messages=[{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
-            temperature=0, max_tokens=self.max_tokens)
-        return {"content": r.choices[0].message.content, "tokens": r.usage.total_tokens}
+    def request_body(self, system, user):
+        return {"model": self.model_name, "temperature": 0, "max_tokens": self.max_tokens,
+                "messages": [{"role": "system", "content": system}, {"role": "user", "content": user}]}
+
+    async def process(self, system, user):
+        r = await self.client.chat.completions.create(**self.request_body(system, user))
+        details = r.usage.prompt_tokens_details
+        return {"content": r.choices[0].message.content, "tokens": r.usage.total_tokens,
+                "cached_tokens": (details.cached_tokens or 0) if details else 0}
 
 
 class ClaudeClient(LLMClient):
-    def __init__(self, model_name, max_tokens):
+    def __init__(self, model_name, max_tokens, concurrency):
         super().__init__(model_name, "claude")
-        self.client = AsyncAnthropic(api_key=ANTHROPIC_API_KEY)
+        self.client = AsyncAnthropic(api_key=ANTHROPIC_API_KEY, max_retries=0,
+                                     http_client=anthropic.DefaultAsyncHttpxClient(limits=pool_limits(concurrency)))
         self.max_tokens = max_tokens
 
-    async def process(self, prompt):
-        r = await self.client.messages.create(
-            model=self.model_name, max_tokens=self.max_tokens, temperature=0,
-            system=SYSTEM_PROMPT, messages=[{"role": "user", "content": prompt}])
-        return {"content": r.content[0].text, "tokens": r.usage.input_tokens + r.usage.output_tokens}
+    def request_body(self, system, user):
+        return {"model": self.model_name, "max_tokens": self.max_tokens, "temperature": 0,
+                "system": [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}],
+                "messages": [{"role": "user", "content": user}]}
+
+    @staticmethod
+    def parse_message(m):
+        u      = m.usage
+        cached = u.cache_read_input_tokens or 0
+        tokens = u.input_tokens + (u.cache_creation_input_tokens or 0) + cached + u.output_tokens
+        return {"content": m.content[0].text, "tokens": tokens, "cached_tokens": cached}
+
+    async def process(self, system, user):
+        return self.parse_message(await self.client.messages.create(**self.request_body(system, user)))
 
 
 class GeminiClient(LLMClient):
-    def __init__(self, model_name, max_tokens):
+    def __init__(self, model_name, max_tokens, concurrency):
         super().__init__(model_name, "gemini")
-        genai.configure(api_key=GOOGLE_API_KEY)
-        safety = {c: HarmBlockThreshold.BLOCK_NONE for c in [
-            HarmCategory.HARM_CATEGORY_HARASSMENT, HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT, HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT]}
-        self.model = genai.GenerativeModel(model_name=model_name, safety_settings=safety,
-            generation_config={"temperature": 0, "top_p": 1, "top_k": 1, "max_output_tokens": max_tokens})
-
-    async def process(self, prompt):
-        loop = asyncio.get_event_loop()
-        r = await loop.run_in_executor(None, lambda: self.model.generate_content(f"{SYSTEM_PROMPT}\n\n{prompt}"))
+        self.model = genai.GenerativeModel(model_name=model_name, safety_settings=GEMINI_SAFETY_SETTINGS,
+            generation_config={**GEMINI_GENERATION_CONFIG, "max_output_tokens": max_tokens})
+
+    async def process(self, system, user):
+        r = await self.model.generate_content_async(f"{system}{user}")
         tokens = (r.usage_metadata.prompt_token_count + r.usage_metadata.candidates_token_count
                   if hasattr(r, "usage_metadata") else None)
-        return {"content": r.text, "tokens": tokens}
+        cached = getattr(r.usage_metadata, "cached_content_token_count", 0) if hasattr(r, "usage_metadata") else 0
+        return {"content": r.text, "tokens": tokens, "cached_tokens": cached or 0}
 
 
 class _HFClient(LLMClient):
-    def __init__(self, model_name, llm_type, max_tokens):
+    def __init__(self, model_name, llm_type, max_tokens, concurrency):
         super().__init__(model_name, llm_type)
-        self.client = AsyncOpenAI(api_key=HUGGINGFACE_API_KEY, base_url="https://router.huggingface.co/v1")
+        self.client = AsyncOpenAI(api_key=HUGGINGFACE_API_KEY, base_url="https://router.huggingface.co/v1",
+                                  max_retries=0,
+                                  http_client=openai.DefaultAsyncHttpxClient(limits=pool_limits(concurrency)))
         self.max_tokens = max_tokens
 
-    async def process(self, prompt):
+    async def process(self, system, user):
         r = await self.client.chat.completions.create(
             model=self.model_name,
-            messages=[{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
+            messages=[{"role": "system", "content": system}, {"role": "user", "content": user}],
             temperature=0, max_tokens=self.max_tokens)
-        return {"content": r.choices[0].message.content, "tokens": r.usage.total_tokens}
+        details = getattr(r.usage, "prompt_tokens_details", None)
+        return {"content": r.choices[0].message.content, "tokens": r.usage.total_tokens,
+                "cached_tokens": (details.cached_tokens or 0) if details else 0}
 
 class LlamaClient(_HFClient):
-    def __init__(self, model_name, max_tokens): super().__init__(model_name, "llama", max_tokens)
+    def __init__(self, model_name, max_tokens, concurrency):
+        super().__init__(model_name, "llama", max_tokens, concurrency)
 
 class DeepseekClient(_HFClient):
-    def __init__(self, model_name, max_tokens): super().__init__(model_name, "deepseek", max_tokens)
+    def __init__(self, model_name, max_tokens, concurrency):
+        super().__init__(model_name, "deepseek", max_tokens, concurrency)
+
+# ----------------------------- BATCH CLIENTS ---------------------------------
+
+async def with_retries(call):
+    # Batch endpoints get the same retry policy as per-row requests (the SDK clients don't retry).
+    async for attempt in retrying():
+        with attempt:
+            return await call()
+
+async def poll_batch(retrieve, done):
+    delay = BATCH_POLL_MIN
+    while not done(batch := await with_retries(retrieve)):
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, BATCH_POLL_MAX)
+    return batch
+
+
+class BatchOpenAIClient(OpenAIClient):
+    """Submits every prompt as one Batch API job; results are keyed by custom_id (file_id).
+
+    submit_batch returns a JSON-serialisable handle so a run interrupted while polling can
+    collect the same (already billed) batch on the next start."""
+
+    async def submit_batch(self, system: str, prompts: Dict[str, str]) -> Dict[str, Any]:
+        # The input file holds every complaint text; it is only needed until the upload finishes.
+        path = os.path.join(self.output_dir, f"batch_input_{datetime.now():%Y%m%d%H%M%S}.jsonl")
+
+        async def upload_file():
+            # Reopened on every attempt so a retry uploads from the start of the file.
+            with open(path, "rb") as f:
+                return await self.client.files.create(file=f, purpose="batch")
+
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                for file_id, user in prompts.items():
+                    f.write(json.dumps({"custom_id": file_id, "method": "POST", "url": "/v1/chat/completions",
+                                        "body": self.request_body(system, user)}) + "\n")
+            upload = await with_retries(upload_file)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+        batch = await with_retries(lambda: self.client.batches.create(
+            input_file_id=upload.id, endpoint="/v1/chat/completions", completion_window="24h"))
+        return {"batch_id": batch.id, "input_file_id": upload.id}
+
+    async def collect_batch(self, handle: Dict[str, Any], file_ids) -> Dict[str, Any]:
+        batch = await poll_batch(lambda: self.client.batches.retrieve(handle["batch_id"]),
+                                 lambda b: b.status in ("completed", "failed", "expired", "cancelled"))
+        with contextlib.suppress(openai.APIError):
+            await self.client.files.delete(handle["input_file_id"])
+
+        results = {}
+        for output_id in (batch.output_file_id, batch.error_file_id):
+            if not output_id:
+                continue
+            content = await with_retries(lambda: self.client.files.content(output_id))
+            for line in content.text.splitlines():
+                entry = json.loads(line)
+                resp  = entry.get("response") or {}
+                if resp.get("status_code") == 200:
+                    body    = resp["body"]
+                    details = body["usage"].get("prompt_tokens_details") or {}
+                    results[entry["custom_id"]] = {"content": body["choices"][0]["message"]["content"],
+                                                   "tokens": body["usage"]["total_tokens"],
+                                                   "cached_tokens": details.get("cached_tokens") or 0}
+                else:
+                    results[entry["custom_id"]] = RuntimeError(json.dumps(entry.get("error") or resp.get("body")))
+        for file_id in file_ids:
+            results.setdefault(file_id, RuntimeError(f"batch {batch.id} ended with status {batch.status}"))
+        return results
+
+
+class BatchClaudeClient(ClaudeClient):
+    """Submits every prompt as one Message Batch; results are keyed by custom_id (file_id)."""
+
+    async def submit_batch(self, system: str, prompts: Dict[str, str]) -> Dict[str, Any]:
+        requests = [{"custom_id": file_id, "params": self.request_body(system, user)}
+                    for file_id, user in prompts.items()]
+        batch = await with_retries(lambda: self.client.messages.batches.create(requests=requests))
+        return {"batch_id": batch.id}
+
+    async def collect_batch(self, handle: Dict[str, Any], file_ids) -> Dict[str, Any]:
+        batch = await poll_batch(lambda: self.client.messages.batches.retrieve(handle["batch_id"]),
+                                 lambda b: b.processing_status == "ended")
+
+        async def fetch_results():
+            # Read fully inside the retry so a dropped stream restarts from the first entry.
+            return [entry async for entry in await self.client.messages.batches.results(batch.id)]
+
+        results = {}
+        for entry in await with_retries(fetch_results):
+            if entry.result.type == "succeeded":
+                results[entry.custom_id] = self.parse_message(entry.result.message)
+            else:
+                results[entry.custom_id] = RuntimeError(f"batch request {entry.result.type}")
+        for file_id in file_ids:
+            results.setdefault(file_id, RuntimeError(f"batch {batch.id} returned no result"))
+        return results
 
 # ----------------------------- FACTORY --------------------------------------
 
-def get_client(llm_type, model_name, max_tokens):
-    return {
-        "openai":    OpenAIClient,
-        "anthropic": ClaudeClient,
-        "google":    GeminiClient,
-        "llama":     LlamaClient,
-        "deepseek":  DeepseekClient,
-    }[MODELS[llm_type]["client_type"]](model_name, max_tokens)
+CLIENTS = {
+    "openai":    OpenAIClient,
+    "anthropic": ClaudeClient,
+    "google":    GeminiClient,
+    "llama":     LlamaClient,
+    "deepseek":  DeepseekClient,
+}
+
+# Providers with a batch endpoint; everything else falls back to per-row async calls.
+BATCH_CLIENTS = {
+    "openai":    BatchOpenAIClient,
+    "anthropic": BatchClaudeClient,
+}
+
+def get_client(llm_type, model_name, max_tokens, concurrency):
+    client_type = MODELS[llm_type]["client_type"]
+    if MODELS[llm_type].get("use_batch") and client_type in BATCH_CLIENTS:
+        return BATCH_CLIENTS[client_type](model_name, max_tokens, concurrency)
+    return CLIENTS[client_type](model_name, max_tokens, concurrency)
 
 # ----------------------------- ROW PROCESSOR ---------------------------------
 
-async def process_row(row, index, client, existing, semaphore, timestamp):
-    async with semaphore:
-        file_id   = row.get("file_id", f"index{index}")
-        complaint = row.get("text_content", "")
-        if file_id in existing:
-            return {"status": "skipped", "file_id": file_id, "reason": "already_saved"}
-        if not isinstance(complaint, str) or not complaint.strip():
-            return {"status": "skipped", "file_id": file_id, "reason": "empty_text"}
-        prompt = prompt_template.replace("{complaint_text}", complaint)
-        start  = time.perf_counter()
+def skip_reason(file_id, complaint, existing) -> Optional[str]:
+    if file_id in existing:
+        return "already_saved"
+    if not isinstance(complaint, str) or not complaint.strip():
+        return "empty_text"
+    return None
+
+def check_content(result):
+    # Refusals and filtered generations come back with no text; treat them as per-row errors.
+    if not isinstance(result["content"], str) or not result["content"].strip():
+        raise ValueError(f"empty response content: {result['content']!r}")
+    return result
+
+def write_text(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+async def save_result(client, file_id, result, timestamp, start, cached=False):
+    # Written on a worker thread so the event loop keeps servicing other requests meanwhile.
+    path = os.path.join(client.output_dir, f"{file_id}_{client.model_name.replace('/', '-')}_{timestamp}.txt")
+    await asyncio.to_thread(write_text, path, result["content"])
+    return {"status": "success", "file_id": file_id, "model": client.model_name,
+            "time": time.perf_counter() - start, "tokens": result["tokens"],
+            "cached_tokens": result["cached_tokens"], "cached": cached}
+
+async def cache_result(cache, key, file_id, result):
+    # Called after the output is on disk: a failed cache write (e.g. a locked database) only costs
+    # a future cache hit, so it is logged rather than failing a row whose response is already saved.
+    try:
+        await cache.put(key, result)
+    except Exception as e:
+        print(f"  cache write failed for {file_id}: {e}")
+
+async def process_row(file_id, complaint, client, existing, limiter, timestamp, cache):
+    if reason := skip_reason(file_id, complaint, existing):
+        return {"status": "skipped", "file_id": file_id, "reason": reason}
+    start = time.perf_counter()
+    try:
+        user = complaint + prompt_suffix
+        key  = cache.key(client.model_name, instructions, user)
+        if hit := await cache.get(key):
+            return await save_result(client, file_id, hit, timestamp, start, cached=True)
+        async for attempt in retrying():
+            with attempt:
+                async with limiter:
+                    result = await client.process(instructions, user)
+        saved = await save_result(client, file_id, check_content(result), timestamp, start)
+        await cache_result(cache, key, file_id, result)
+        return saved
+    except Exception as e:
+        return {"status": "error", "file_id": file_id, "error": str(e),
+                "time": time.perf_counter() - start}
+
+async def run_rows(client, existing, timestamp, cache, record, concurrency, rpm):
+    # `concurrency` workers drain a bounded queue, so at most that many requests are in flight and
+    # only a few rows are queued ahead of them; the limiter spaces requests out to stay under rpm.
+    queue   = asyncio.Queue(maxsize=2 * concurrency)
+    limiter = AsyncLimiter(rpm, 60)
+
+    async def worker():
+        while (item := await queue.get()) is not None:
+            try:
+                record(await process_row(*item, client, existing, limiter, timestamp, cache))
+            except Exception as e:
+                record({"status": "error", "error": str(e)})
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    for item in zip(file_ids, texts):
+        await queue.put(item)
+    for _ in workers:
+        await queue.put(None)
+    await asyncio.gather(*workers)
+
+async def collect_pending(client, pending, pending_path, timestamp, cache, record, start):
+    # The batch is already paid for, so one bad result must not stop the rest from being saved.
+    # Returns every file_id the batch covered: failures are retried on the next run, not resubmitted now.
+    keys = pending["keys"]
+    for file_id, result in (await client.collect_batch(pending, list(keys))).items():
         try:
-            result = await client.process(prompt)
-            path   = os.path.join(client.output_dir,
-                                  f"{file_id}_{client.model_name.replace('/', '-')}_{timestamp}.txt")
-            with open(path, "w", encoding="utf-8") as f:
-                f.write(result["content"])
-            return {"status": "success", "file_id": file_id, "model": client.model_name,
-                    "time": time.perf_counter() - start, "tokens": result["tokens"]}
+            if isinstance(result, Exception):
+                raise result
+            record(await save_result(client, file_id, check_content(result), timestamp, start))
+            await cache_result(cache, keys[file_id], file_id, result)
+        except Exception as e:
+            record({"status": "error", "file_id": file_id, "error": str(e),
+                    "time": time.perf_counter() - start})
+    os.remove(pending_path)
+    return set(keys)
+
+async def run_batch(client, existing, timestamp, cache, record):
+    # The submitted batch id (and each row's cache key) is kept in pending_batch.json until its
+    # results are saved, so an interrupted run resumes that batch instead of paying for a new one.
+    pending_path = os.path.join(client.output_dir, "pending_batch.json")
+    start        = time.perf_counter()
+    resumed      = set()
+    if os.path.exists(pending_path):
+        with open(pending_path, encoding="utf-8") as f:
+            pending = json.load(f)
+        print(f"  resuming batch {pending['batch_id']} ({len(pending['keys'])} rows)")
+        resumed = await collect_pending(client, pending, pending_path, timestamp, cache, record, start)
+
+    prompts, keys = {}, {}
+    for file_id, complaint in zip(file_ids, texts):
+        if file_id in resumed:
+            continue
+        if reason := skip_reason(file_id, complaint, existing):
+            record({"status": "skipped", "file_id": file_id, "reason": reason})
+            continue
+        try:
+            user = complaint + prompt_suffix
+            key  = cache.key(client.model_name, instructions, user)
+            if hit := await cache.get(key):
+                record(await save_result(client, file_id, hit, timestamp, start, cached=True))
+            else:
+                prompts[file_id], keys[file_id] = user, key
         except Exception as e:
-            return {"status": "error", "file_id": file_id, "error": str(e),
-                    "time": time.perf_counter() - start}
+            record({"status": "error", "file_id": file_id, "error": str(e),
+                    "time": time.perf_counter() - start})
+    if not prompts:
+        return
+    pending = {**await client.submit_batch(instructions, prompts), "keys": keys}
+    with open(pending_path, "w", encoding="utf-8") as f:
+        json.dump(pending, f)
+    await collect_pending(client, pending, pending_path, timestamp, cache, record, start)
 
 # ----------------------------- MODEL RUNNER ----------------------------------
 
-async def run_model(llm_type, model_config, timestamp):
+async def run_model(llm_type, model_config, timestamp, run_id, cache):
     if not model_config["enabled"]:
         return None
     print(f"\n  {llm_type.upper()} — {model_config['model_name']}")
     t0        = time.perf_counter()
-    client    = get_client(llm_type, model_config["model_name"], model_config["max_tokens"])
+    client    = get_client(llm_type, model_config["model_name"], model_config["max_tokens"],
+                           model_config["max_concurrency"])
     existing  = client.get_existing_file_ids()
-    semaphore = asyncio.Semaphore(BATCH_SIZE)
-    tasks     = [process_row(row, i, client, existing, semaphore, timestamp) for i, row in df.iterrows()]
-    raw       = await asyncio.gather(*tasks, return_exceptions=True)
-    results   = [{"status": "error", "error": str(r)} if isinstance(r, Exception) else r for r in raw]
 
-    successes = [r for r in results if r["status"] == "success"]
-    errors    = [r for r in results if r["status"] == "error"]
-    skipped   = [r for r in results if r["status"] == "skipped"]
-    elapsed   = time.perf_counter() - t0
-    tokens    = sum(r.get("tokens") or 0 for r in successes)
-
-    print(f"  done {elapsed:.1f}s — success={len(successes)} error={len(errors)} skipped={len(skipped)} tokens={tokens:,}")
+    # Each row result is appended as soon as it completes, so an interrupted run leaves a valid
+    # partial log and no per-row results are held in memory. The log is named per run (not per day)
+    # so a same-day rerun after Ctrl-C doesn't truncate the previous run's partial log.
+    results_path = os.path.join(client.output_dir, f"results_{run_id}.jsonl")
+    with open(results_path, "w", encoding="utf-8") as out:
+        def record(result):
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+        if hasattr(client, "submit_batch"):
+            await run_batch(client, existing, timestamp, cache, record)
+        else:
+            await run_rows(client, existing, timestamp, cache, record,
+                           model_config["max_concurrency"], model_config["rpm"])
+
+    counts = {"success": 0, "error": 0, "skipped": 0}
+    cached = tokens = prefix = 0
+    with open(results_path, encoding="utf-8") as f:
+        for line in f:
+            r = json.loads(line)
+            counts[r["status"]] += 1
+            if r["status"] == "success":
+                cached += r["cached"]
+                tokens += 0 if r["cached"] else r.get("tokens") or 0
+                prefix += r["cached_tokens"]
+    elapsed = time.perf_counter() - t0
+
+    print(f"  done {elapsed:.1f}s — success={counts['success']} (cached={cached}) error={counts['error']} "
+          f"skipped={counts['skipped']} tokens={tokens:,} prefix_cached={prefix:,}")
 
     summary = {"llm_type": llm_type, "model_name": model_config["model_name"], "timestamp": timestamp,
-               "total_runtime": elapsed, "success_count": len(successes), "error_count": len(errors),
-               "skipped_count": len(skipped), "total_tokens": tokens, "results": results}
+               "total_runtime": elapsed, "success_count": counts["success"], "cached_count": cached,
+               "error_count": counts["error"], "skipped_count": counts["skipped"], "total_tokens": tokens,
+               "cached_tokens": prefix, "results_file": results_path}
     with open(os.path.join(client.output_dir, f"summary_{timestamp}.json"), "w") as f:
         json.dump(summary, f, indent=2)
     return summary
@@ -189,24 +529,42 @@ async def run_model(llm_type, model_config, timestamp):
 # ----------------------------- MAIN ------------------------------------------
 
 async def main():
-    timestamp = datetime.now().strftime("%Y%m%d")
+    now       = datetime.now()
+    timestamp = now.strftime("%Y%m%d")
+    run_id    = now.strftime("%Y%m%d%H%M%S")
     print(f"\nExtracting {len(df)} rows | {sum(1 for m in MODELS.values() if m['enabled'])} models active")
-    t0   = time.perf_counter()
-    raw  = await asyncio.gather(*[run_model(k, v, timestamp) for k, v in MODELS.items() if v["enabled"]],
-                                 return_exceptions=True)
+    t0    = time.perf_counter()
+    os.makedirs(DATA_DIR, exist_ok=True)
+    cache = LLMCache(CACHE_DB)
+    await cache.open()
+    enabled = [k for k, v in MODELS.items() if v["enabled"]]
+    try:
+        raw = await asyncio.gather(*[run_model(k, MODELS[k], timestamp, run_id, cache) for k in enabled],
+                                   return_exceptions=True)
+    finally:
+        await cache.close()
     summaries = {s["llm_type"]: s for s in raw if s and not isinstance(s, Exception)}
     print(f"\nTotal: {time.perf_counter()-t0:.1f}s")
+    for lt, r in zip(enabled, raw):
+        if isinstance(r, Exception):
+            print(f"  {lt}: FAILED — {type(r).__name__}: {r}")
     for lt, s in summaries.items():
         print(f"  {lt}: success={s['success_count']} tokens={s['total_tokens']:,}")
-    os.makedirs(DATA_DIR, exist_ok=True)
     with open(os.path.join(DATA_DIR, f"combined_summary_{timestamp}.json"), "w") as f:
         json.dump(summaries, f, indent=2)
 
 if __name__ == "__main__":
-    df = pd.read_csv(FILTERED_CSV)
+    df = pd.read_csv(FILTERED_CSV, usecols=["file_id", "text_content"],
+                     dtype={"file_id": "string", "text_content": "string"})
     if SAMPLE_SIZE:
         df = df.sample(SAMPLE_SIZE)
+    # Split once: everything before the complaint is a static prefix sent as the system message (and
+    # picked up by provider-side prompt caching); each row only appends its complaint to the suffix.
     with open(PROMPT_FILE) as f:
-        prompt_template = f.read()
+        prompt_prefix, prompt_suffix = f.read().split("{complaint_text}", 1)
+    instructions = f"{SYSTEM_PROMPT}\n\n{prompt_prefix}"
+    # Plain column arrays; iterating them avoids boxing every row into a Series.
+    file_ids = df["file_id"].to_numpy()
+    texts    = df["text_content"].to_numpy()
     os.makedirs(EXTRACT_DIR, exist_ok=True)
     asyncio.run(main())
@@ -6,8 +6,10 @@ import os
 import json
 import re
 import uuid
+import orjson
 import pandas as pd
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 
 # ----------------------------- CONFIG ----------------------------------------
 
@@ -18,6 +20,34 @@ DATA_DIR      = cfg["paths"]["data_dir"]
 EXTRACT_DIR   = Path(cfg["paths"]["extract_dir"]) / cfg["parameters"]["extract_model"]
 FILTERED_CSV  = os.path.join(DATA_DIR, "filtered_texts.csv")
 
+# ----------------------------- SCHEMA ----------------------------------------
+
+# Fields read from each extracted object; a missing field becomes "".
+INCIDENT_KEYS  = ("incident_id", "location_street", "location_city", "location_county",
+                  "location_state", "location_zip", "location_type")
+PLAINTIFF_KEYS = ("plaintiff_id", "name", "race", "gender", "disability_status",
+                  "immigration_status", "plaintiff_compliance")
+DEFENDANT_KEYS = ("defendant_id", "name", "race", "gender", "doe_status", "entity_type",
+                  "agency", "agency_type", "role_in_incident")
+HARM_KEYS      = ("harm_description", "associated_plaintiff_ids", "associated_defendant_ids")
+
+INCIDENT_COLUMNS  = ("source_file", "incident_uuid", "file_id", *INCIDENT_KEYS)
+PLAINTIFF_COLUMNS = ("source_file", "plaintiff_uuid", "incident_uuid", "file_id", *PLAINTIFF_KEYS)
+DEFENDANT_COLUMNS = ("source_file", "defendant_uuid", "incident_uuid", "file_id", *DEFENDANT_KEYS)
+HARM_COLUMNS      = ("source_file", "harm_uuid", "incident_uuid", "file_id",
+                     "harm_description", "harm_type", "associated_plaintiff_ids", "associated_defendant_ids")
+
+def fields_getter(keys):
+    # Generated once per schema: `lambda obj: (obj.get(k1, ""), obj.get(k2, ""), ...)`. Unrolled
+    # .get calls skip both a per-object dict copy and a per-key loop.
+    fields = ", ".join(f'obj.get({k!r}, "")' for k in keys)
+    return eval(f"lambda obj: ({fields},)")
+
+get_incident  = fields_getter(INCIDENT_KEYS)
+get_plaintiff = fields_getter(PLAINTIFF_KEYS)
+get_defendant = fields_getter(DEFENDANT_KEYS)
+get_harm      = fields_getter(HARM_KEYS)
+
 # ----------------------------- HELPERS ---------------------------------------
 
 def get_file_id(filename):
@@ -27,87 +57,84 @@ def get_file_id(filename):
 def parse_extraction(filepath):
     with open(filepath, encoding="utf-8") as f:
         raw = f.read().strip()
-    raw  = re.sub(r"^```(?:json)?\s*", "", raw)
-    raw  = re.sub(r"\s*```$",          "", raw)
-    data = json.loads(raw)
+    if raw.startswith("```"):
+        raw = raw[3:].removeprefix("json")
+    data = orjson.loads(raw.removesuffix("```"))
     return [data] if isinstance(data, dict) else data
 
+def uuid_pool(n):
+    # One urandom read for all of a file's keys instead of one per uuid4() call.
+    raw = os.urandom(16 * n)
+    return iter([str(uuid.UUID(bytes=raw[i:i + 16], version=4)) for i in range(0, 16 * n, 16)])
+
+def count_rows(incidents):
+    # Upper bound on keys needed: one per incident, plaintiff, defendant and harm type.
+    return sum(1 + len(inc.get("plaintiffs", [])) + len(inc.get("defendants", []))
+               + sum(h.get("type", "").count(";") + 1 for h in inc.get("harms", []))
+               for inc in incidents)
+
 def extraction_to_tables(filepath):
+    # Plain row tuples; DataFrames are built once per table in load_folder, not once per file.
     incidents_rows, plaintiffs_rows, defendants_rows, harms_rows = [], [], [], []
-    file_id = get_file_id(filepath)
-    for inc in parse_extraction(filepath):
-        iid = str(uuid.uuid4())
-        incidents_rows.append({
-            "incident_uuid": iid, "file_id": file_id,
-            "incident_id":     inc.get("incident_id", ""),
-            "location_street": inc.get("location_street", ""),
-            "location_city":   inc.get("location_city", ""),
-            "location_county": inc.get("location_county", ""),
-            "location_state":  inc.get("location_state", ""),
-            "location_zip":    inc.get("location_zip", ""),
-            "location_type":   inc.get("location_type", ""),
-        })
+    source    = Path(filepath).name
+    file_id   = get_file_id(filepath)
+    incidents = parse_extraction(filepath)
+    uuids     = uuid_pool(count_rows(incidents))
+    for inc in incidents:
+        iid = next(uuids)
+        incidents_rows.append((source, iid, file_id) + get_incident(inc))
         for p in inc.get("plaintiffs", []):
-            plaintiffs_rows.append({
-                "plaintiff_uuid": str(uuid.uuid4()), "incident_uuid": iid, "file_id": file_id,
-                "plaintiff_id": p.get("plaintiff_id", ""), "name": p.get("name", ""),
-                "race": p.get("race", ""), "gender": p.get("gender", ""),
-                "disability_status":    p.get("disability_status", ""),
-                "immigration_status":   p.get("immigration_status", ""),
-                "plaintiff_compliance": p.get("plaintiff_compliance", ""),
-            })
+            plaintiffs_rows.append((source, next(uuids), iid, file_id) + get_plaintiff(p))
         for d in inc.get("defendants", []):
-            defendants_rows.append({
-                "defendant_uuid": str(uuid.uuid4()), "incident_uuid": iid, "file_id": file_id,
-                "defendant_id": d.get("defendant_id", ""), "name": d.get("name", ""),
-                "race": d.get("race", ""), "gender": d.get("gender", ""),
-                "doe_status": d.get("doe_status", ""), "entity_type": d.get("entity_type", ""),
-                "agency": d.get("agency", ""), "agency_type": d.get("agency_type", ""),
-                "role_in_incident": d.get("role_in_incident", ""),
-            })
+            defendants_rows.append((source, next(uuids), iid, file_id) + get_defendant(d))
         for h in inc.get("harms", []):
+            description, plaintiff_ids, defendant_ids = get_harm(h)
             for harm_type in h.get("type", "").split(";"):
                 if harm_type.strip():
-                    harms_rows.append({
-                        "harm_uuid": str(uuid.uuid4()), "incident_uuid": iid, "file_id": file_id,
-                        "harm_description":         h.get("harm_description", ""),
-                        "harm_type":                harm_type.strip(),
-                        "associated_plaintiff_ids": h.get("associated_plaintiff_ids", ""),
-                        "associated_defendant_ids": h.get("associated_defendant_ids", ""),
-                    })
-    return (pd.DataFrame(incidents_rows), pd.DataFrame(plaintiffs_rows),
-            pd.DataFrame(defendants_rows), pd.DataFrame(harms_rows))
+                    harms_rows.append((source, next(uuids), iid, file_id,
+                                       description, harm_type.strip(), plaintiff_ids, defendant_ids))
+    return incidents_rows, plaintiffs_rows, defendants_rows, harms_rows
+
+def write_parquet(df, name):
+    # JSON values can mix ints and strings within a column, so every column is stored as text;
+    # "" becomes missing, matching how readr read the old CSV outputs.
+    df.replace("", pd.NA).astype("string").to_parquet(
+        os.path.join(DATA_DIR, name), engine="pyarrow", compression="zstd", index=False)
+
+def _parse_one(path_str):
+    # Module-level so worker processes can unpickle it; errors are returned, not raised.
+    try:
+        return (*extraction_to_tables(path_str), None)
+    except Exception as e:
+        return [], [], [], [], {"file": Path(path_str).name, "error": str(e)}
+
+def load_folder(folder_path):
+    all_i, all_p, all_d, all_h, failed = [], [], [], [], []
+    paths = sorted(Path(folder_path).glob("*.txt"))
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        for i, p, d, h, err in ex.map(_parse_one, map(str, paths), chunksize=32):
+            if err:
+                failed.append(err)
+            all_i += i; all_p += p; all_d += d; all_h += h
+    return (pd.DataFrame(all_i, columns=INCIDENT_COLUMNS), pd.DataFrame(all_p, columns=PLAINTIFF_COLUMNS),
+            pd.DataFrame(all_d, columns=DEFENDANT_COLUMNS), pd.DataFrame(all_h, columns=HARM_COLUMNS), failed)
 
 # ----------------------------- MAIN ------------------------------------------
 
 if __name__ == "__main__":
-    all_i, all_p, all_d, all_h, failed = [], [], [], [], []
+    incidents, plaintiffs, defendants, harms, failed = load_folder(EXTRACT_DIR)
 
-    for txt in sorted(EXTRACT_DIR.glob("*.txt")):
-        try:
-            i, p, d, h = extraction_to_tables(str(txt))
-            for df in [i, p, d, h]:
-                df.insert(0, "source_file", txt.name)
-            all_i.append(i); all_p.append(p); all_d.append(d); all_h.append(h)
-        except Exception as e:
-            failed.append({"file": txt.name, "error": str(e)})
-
-    incidents  = pd.concat(all_i, ignore_index=True)
-    plaintiffs = pd.concat(all_p, ignore_index=True)
-    defendants = pd.concat(all_d, ignore_index=True)
-    harms      = pd.concat(all_h, ignore_index=True)
-
-    lookup = pd.read_csv(FILTERED_CSV, dtype=str)[["file_id", "document_id", "case_id"]].drop_duplicates()
+    lookup = pd.read_csv(FILTERED_CSV, dtype=str, usecols=["file_id", "document_id", "case_id"]).drop_duplicates()
     incidents  = incidents .merge(lookup, on="file_id", how="left")
     plaintiffs = plaintiffs.merge(lookup, on="file_id", how="left")
     defendants = defendants.merge(lookup, on="file_id", how="left")
     harms      = harms     .merge(lookup, on="file_id", how="left")
 
     os.makedirs(DATA_DIR, exist_ok=True)
-    incidents .to_csv(os.path.join(DATA_DIR, "incidents_extract.csv"),  index=False)
-    plaintiffs.to_csv(os.path.join(DATA_DIR, "plaintiffs_extract.csv"), index=False)
-    defendants.to_csv(os.path.join(DATA_DIR, "defendants_extract.csv"), index=False)
-    harms     .to_csv(os.path.join(DATA_DIR, "harms_extract.csv"),      index=False)
+    write_parquet(incidents,  "incidents_extract.parquet")
+    write_parquet(plaintiffs, "plaintiffs_extract.parquet")
+    write_parquet(defendants, "defendants_extract.parquet")
+    write_parquet(harms,      "harms_extract.parquet")
 
     print(f"Saved: {len(incidents)} incidents | {len(plaintiffs)} plaintiffs | "
           f"{len(defendants)} defendants | {len(harms)} harms | {len(failed)} failed")